@@ -1,33 +1,86 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+import logging.handlers
+import queue
+import atexit
 import sqlite3
+from contextlib import contextmanager
 from twelvelabs import TwelveLabs
 from twelvelabs.models.embed import EmbeddingsTask
 import hashlib
+import io
+import json
 import numpy as np
 import os
 from datetime import datetime, timezone
 import sys
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import uuid
 import asyncio
-import pytz
+import bisect
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+from cachetools import LRUCache, TTLCache
 import openai
+import orjson
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 # Configure logging with PST timezone
-pst = pytz.timezone('US/Pacific')
+pst = ZoneInfo('America/Los_Angeles')
 
 class PSTFormatter(logging.Formatter):
+    _tz = pst
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Formatted timestamp for the most recent second; log bursts share it
+        self._cached_time = (None, None, None)
+    
     def formatTime(self, record, datefmt=None):
-        dt = datetime.fromtimestamp(record.created, tz=pst)
-        if datefmt:
-            return dt.strftime(datefmt)
-        else:
-            return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
+        second = int(record.created)
+        cached_second, cached_datefmt, formatted = self._cached_time
+        if second == cached_second and datefmt == cached_datefmt:
+            return formatted
+        dt = datetime.fromtimestamp(second, tz=self._tz)
+        formatted = dt.strftime(datefmt or '%Y-%m-%d %H:%M:%S %Z')
+        self._cached_time = (second, datefmt, formatted)
+        return formatted
+
+class JSONFormatter(logging.Formatter):
+    """Render log records as single-line JSON objects."""
+    
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "lvl": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue records as-is; the listener's handlers format them, tracebacks included."""
+    
+    def prepare(self, record):
+        # The queue never leaves this process, so there's nothing to make picklable
+        return record
 
 logging.basicConfig(
     level=logging.INFO,
@@ -35,9 +88,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Set the formatter for the root logger
-for handler in logging.root.handlers:
-    handler.setFormatter(PSTFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Configure the root handlers only once, even if this module is imported a second time
+if not any(isinstance(handler, logging.handlers.QueueHandler) for handler in logging.root.handlers):
+    # Set the formatter for the root logger (LOG_FORMAT=json for structured output)
+    for handler in logging.root.handlers:
+        if LOG_FORMAT == "json":
+            handler.setFormatter(JSONFormatter())
+        else:
+            handler.setFormatter(PSTFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    # Hand records to a background listener so handler I/O stays off the event loop
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, *logging.root.handlers, respect_handler_level=True)
+    logging.root.handlers = [LocalQueueHandler(log_queue)]
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # Pydantic models
 class ApiKeyRequest(BaseModel):
@@ -54,6 +121,19 @@ class VideoUploadResponse(BaseModel):
     embedding_id: str
     status: str
 
+class UploadUrlRequest(BaseModel):
+    filename: str
+    content_type: str
+
+class UploadUrlResponse(BaseModel):
+    url: str
+    fields: Dict[str, str]
+    s3_url: str
+
+class RegisterUploadRequest(BaseModel):
+    s3_url: str
+    filename: str
+
 class DifferenceSegment(BaseModel):
     start_sec: float
     end_sec: float
@@ -72,6 +152,22 @@ class ComparisonResponse(BaseModel):
     differing_segments: int
     threshold_used: float
 
+class SegmentMatch(BaseModel):
+    segment_index: int
+    start_sec: float
+    end_sec: float
+    similarity: float
+
+class SimilarSegments(BaseModel):
+    start_sec: float
+    end_sec: float
+    matches: List[SegmentMatch]
+
+class SimilarSegmentsResponse(BaseModel):
+    filename1: str
+    filename2: str
+    segments: List[SimilarSegments]
+
 class HealthResponse(BaseModel):
     status: str
     version: str
@@ -97,7 +193,7 @@ class OpenAIAnalysisResponse(BaseModel):
     time_segments: List[str]
 
 # FastAPI app
-app = FastAPI(title="SAGE Backend", version="2.0.0")
+app = FastAPI(title="SAGE Backend", version="2.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -116,52 +212,92 @@ app.add_middleware(
 # Request logging middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = datetime.now()
+    start_ns = time.perf_counter_ns()
     client_host = request.client.host if request.client else "unknown"
     path = str(request.url.path)
     
     try:
         response = await call_next(request)
-        duration = (datetime.now() - start_time).total_seconds()
+        duration = (time.perf_counter_ns() - start_ns) / 1e9
         
         if response.status_code >= 400:
-            logger.warning(f"{client_host} - {request.method} {path} - {response.status_code} ({duration:.3f}s)")
+            logger.warning("%s - %s %s - %s (%.3fs)", client_host, request.method, path, response.status_code, duration)
         else:
-            logger.info(f"{client_host} - {request.method} {path} - {response.status_code} ({duration:.3f}s)")
+            logger.info("%s - %s %s - %s (%.3fs)", client_host, request.method, path, response.status_code, duration)
         
         return response
     except Exception as e:
-        duration = (datetime.now() - start_time).total_seconds()
-        logger.error(f"{client_host} - {request.method} {path} - Error: {str(e)} ({duration:.3f}s)")
+        duration = (time.perf_counter_ns() - start_ns) / 1e9
+        logger.error("%s - %s %s - Error: %s (%.3fs)", client_host, request.method, path, e, duration)
         raise
 
 # Database setup
 DB_PATH = "sage.db"
+DB_POOL_SIZE = 4
+
+# Applied once per pooled connection
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=30000000",
+    "PRAGMA cache_size=-2000",
+    "PRAGMA busy_timeout=5000",
+)
+
+db_pool: queue.SimpleQueue = queue.SimpleQueue()
+
+def create_db_connection() -> sqlite3.Connection:
+    """Open a SQLite connection tuned for the API keys store."""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def db_connection():
+    """Borrow a connection from the pool, returning it when done."""
+    try:
+        conn = db_pool.get_nowait()
+    except queue.Empty:
+        conn = create_db_connection()
+    
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if db_pool.qsize() < DB_POOL_SIZE:
+            db_pool.put(conn)
+        else:
+            conn.close()
 
 def init_database():
     """Initialize the database with API keys table."""
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        cursor = conn.execute("PRAGMA table_info(api_keys)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'api_key' not in columns:
-            conn.execute('ALTER TABLE api_keys ADD COLUMN api_key TEXT')
+    with db_connection() as conn:
+        try:
+            cursor = conn.execute("PRAGMA table_info(api_keys)")
+            columns = [column[1] for column in cursor.fetchall()]
+        
+            if 'api_key' not in columns:
+                conn.execute('ALTER TABLE api_keys ADD COLUMN api_key TEXT')
+                conn.commit()
+                logger.info("Added api_key column to existing api_keys table")
+        except Exception:
+            logger.info("Creating new api_keys table")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS api_keys (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key_hash TEXT UNIQUE NOT NULL,
+                    api_key TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
             conn.commit()
-            logger.info("Added api_key column to existing api_keys table")
-    except Exception:
-        logger.info("Creating new api_keys table")
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS api_keys (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key_hash TEXT UNIQUE NOT NULL,
-                api_key TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        
+        # Covering index so the latest-key lookup reads one index entry instead of sorting the table
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_api_keys_created ON api_keys (created_at DESC, api_key)')
         conn.commit()
-    finally:
-        conn.close()
 
 # Initialize database
 init_database()
@@ -171,6 +307,20 @@ S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "tl-sage-bucket")
 S3_REGION = os.getenv("S3_REGION", "us-east-2")
 S3_PROFILE = os.getenv("S3_PROFILE", "dev")
 
+# Upload configuration
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 ** 3)))  # 5GB
+ENABLE_LEGACY_UPLOAD = os.getenv("ENABLE_LEGACY_UPLOAD", "true").lower() == "true"
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "6"))  # Parallel multipart part uploads
+# Files at or below this size are streamed to S3 in a single PUT
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(64 * 1024 * 1024)))  # 64MB
+
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=16 * 1024 * 1024,  # 16MB parts
+    max_concurrency=S3_UPLOAD_CONCURRENCY,
+    use_threads=True
+)
+
 # Initialize S3 client
 s3_client = None
 try:
@@ -183,21 +333,78 @@ except Exception as e:
     logger.warning("S3 functionality will be disabled. Make sure AWS SSO is configured and you're logged in.")
     s3_client = None
 
+# Presigned GET URLs are reused while they have at least PRESIGNED_URL_MIN_REMAINING seconds left
+PRESIGNED_URL_EXPIRATION = 3600
+PRESIGNED_URL_MIN_REMAINING = 600
+presigned_url_cache = TTLCache(maxsize=1024, ttl=PRESIGNED_URL_EXPIRATION - PRESIGNED_URL_MIN_REMAINING)
+presigned_url_lock = threading.Lock()
+
+# In-memory cache limits
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "256"))
+VIDEO_CACHE_SIZE = int(os.getenv("VIDEO_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_PREFIX = "cache/embeddings"
+
+# Local directory for memory-mapped embedding matrices, so they live in the page cache
+# rather than the Python heap
+EMBEDDING_MMAP_DIR = os.getenv("EMBEDDING_MMAP_DIR", "embedding_cache")
+os.makedirs(EMBEDDING_MMAP_DIR, exist_ok=True)
+
+# Log int8 quantization error against the float32 embeddings at ingest
+VERIFY_QUANTIZATION = os.getenv("VERIFY_QUANTIZATION", "false").lower() == "true"
+
+# Dequantized float32 matrices kept for repeated similarity searches
+DEQUANTIZED_CACHE_SIZE = int(os.getenv("DEQUANTIZED_CACHE_SIZE", "8"))
+
+# Metadata saved alongside evicted embedding arrays
+PERSISTED_EMBEDDING_FIELDS = ("filename", "video_id", "s3_url", "duration", "task_id", "completed_at")
+
+# Background thread for persisting evicted embeddings
+persist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embedding-persist")
+
+class EmbeddingCache(LRUCache):
+    """LRU cache of finished embedding data that saves evicted completed embeddings to S3.
+    
+    Pending and processing jobs live in embedding_jobs until they finish, so they are never evicted.
+    """
+    
+    def popitem(self):
+        embedding_id, embed_data = super().popitem()
+        with dequantized_lock:
+            dequantized_storage.pop(embedding_id, None)
+        if embed_data.get("status") == "completed":
+            # Stay reachable until the S3 copy exists, so lookups don't 404 in between
+            evicted_embeddings[embedding_id] = embed_data
+            persist_executor.submit(release_embedding, embedding_id, embed_data)
+        return embedding_id, embed_data
+
 # Global state
-embedding_storage: Dict[str, Any] = {}
-video_storage: Dict[str, Dict[str, Any]] = {}
+embedding_storage: Dict[str, Any] = EmbeddingCache(maxsize=EMBEDDING_CACHE_SIZE)
+embedding_jobs: Dict[str, Dict[str, Any]] = {}  # pending/processing embeddings, moved to embedding_storage when done
+evicted_embeddings: Dict[str, Dict[str, Any]] = {}  # evicted embeddings whose S3 persist hasn't finished yet
+embedding_reloads: Dict[str, asyncio.Task] = {}  # in-progress S3 reloads, shared by concurrent lookups
+missing_embeddings = TTLCache(maxsize=1024, ttl=60)  # ids recently found in neither memory nor S3
+dequantized_storage: Dict[str, np.ndarray] = LRUCache(maxsize=DEQUANTIZED_CACHE_SIZE)
+dequantized_lock = threading.Lock()  # similarity searches fill dequantized_storage from worker threads
+video_storage: Dict[str, Dict[str, Any]] = LRUCache(maxsize=VIDEO_CACHE_SIZE)
 current_api_key = None
+last_stored_key = None  # Most recent key written to the api_keys table
+validated_keys = TTLCache(maxsize=256, ttl=600)  # SHA-256 digests of keys that passed a live check
 tl_client = None
-start_time = datetime.now()
+start_monotonic = 0.0  # Event loop clock reading at startup
 active_tasks: Dict[str, Any] = {}
 
-# Add a queue for pending videos at the top of the file, after the existing storage variables
-pending_videos = []  # Queue for videos waiting to be processed
-processing_video = None  # Currently processing video ID
+# Embedding jobs waiting for a worker
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2"))
+EMBED_QUEUE_SIZE = int(os.getenv("EMBED_QUEUE_SIZE", "100"))
+embed_queue: asyncio.Queue = asyncio.Queue(maxsize=EMBED_QUEUE_SIZE)
+embed_workers: List[asyncio.Task] = []
+
+# Thread pool for blocking TwelveLabs SDK and boto3 calls made by the embedding workers
+sdk_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY * 2, thread_name_prefix="sdk")
 
 # Utility functions
-def get_s3_presigned_url(s3_url: str, expiration: int = 3600) -> str:
-    """Generate a presigned URL for an S3 object."""
+def get_s3_presigned_url(s3_url: str, expiration: int = PRESIGNED_URL_EXPIRATION) -> str:
+    """Generate a presigned URL for an S3 object, reusing a cached one while it is still fresh."""
     if not s3_client:
         raise Exception("S3 client not initialized")
     
@@ -208,12 +415,21 @@ def get_s3_presigned_url(s3_url: str, expiration: int = 3600) -> str:
     else:
         raise Exception("Invalid S3 URL format")
     
+    cache_key = (bucket, key, expiration)
+    with presigned_url_lock:
+        presigned_url = presigned_url_cache.get(cache_key)
+    if presigned_url:
+        return presigned_url
+    
     try:
         presigned_url = s3_client.generate_presigned_url(
             'get_object',
             Params={'Bucket': bucket, 'Key': key},
             ExpiresIn=expiration
         )
+        if expiration == PRESIGNED_URL_EXPIRATION:
+            with presigned_url_lock:
+                presigned_url_cache[cache_key] = presigned_url
         return presigned_url
     except ClientError as e:
         logger.error(f"Failed to generate presigned URL: {e}")
@@ -227,74 +443,410 @@ async def upload_to_s3_streaming(file: UploadFile) -> str:
     file_key = f"videos/{uuid.uuid4()}_{file.filename}"
     
     try:
-        logger.info(f"Starting streaming S3 upload for {file.filename}")
-        
-        # Use multipart upload for large files
-        response = s3_client.create_multipart_upload(
-            Bucket=S3_BUCKET_NAME,
-            Key=file_key,
-            ContentType=file.content_type,
-            Metadata={
-                'original_filename': file.filename,
-                'upload_timestamp': datetime.now().isoformat()
-            }
+        logger.info("Starting streaming S3 upload for %s", file.filename)
+        
+        # TransferManager reads parts from the spooled upload file into a bounded buffer
+        # while earlier parts upload on its thread pool, aborting the upload if any part fails
+        await file.seek(0)
+        await asyncio.to_thread(
+            s3_client.upload_fileobj,
+            file.file,
+            S3_BUCKET_NAME,
+            file_key,
+            ExtraArgs={
+                'ContentType': file.content_type,
+                'Metadata': {
+                    'original_filename': file.filename,
+                    'upload_timestamp': datetime.now().isoformat()
+                }
+            },
+            Config=S3_TRANSFER_CONFIG
         )
         
-        upload_id = response['UploadId']
-        parts = []
-        part_number = 1
-        chunk_size = 10 * 1024 * 1024  # 10MB chunks
+        s3_url = f"s3://{S3_BUCKET_NAME}/{file_key}"
+        logger.info("File uploaded to S3: %s", s3_url)
+        return s3_url
         
-        try:
-            while True:
-                chunk = await file.read(chunk_size)
-                if not chunk:
-                    break
-                
-                logger.info(f"Uploading part {part_number} for {file.filename} ({len(chunk)} bytes)")
-                
-                part_response = s3_client.upload_part(
-                    Bucket=S3_BUCKET_NAME,
-                    Key=file_key,
-                    PartNumber=part_number,
-                    UploadId=upload_id,
-                    Body=chunk
-                )
-                
-                parts.append({
-                    'ETag': part_response['ETag'],
-                    'PartNumber': part_number
-                })
-                
-                part_number += 1
-            
-            # Complete multipart upload
-            s3_client.complete_multipart_upload(
-                Bucket=S3_BUCKET_NAME,
-                Key=file_key,
-                UploadId=upload_id,
-                MultipartUpload={'Parts': parts}
-            )
-            
-            s3_url = f"s3://{S3_BUCKET_NAME}/{file_key}"
-            logger.info(f"File uploaded to S3: {s3_url}")
-            return s3_url
-            
-        except Exception as e:
-            # Abort multipart upload on error
+    except (ClientError, S3UploadFailedError) as e:
+        logger.error("Failed to upload file to S3: %s", e)
+        raise Exception(f"S3 upload failed: {str(e)}")
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_distances(Q1, Q2, qq1, qq2, out):
+        """Cosine distance between paired int8 rows of Q1 and Q2 with squared norms qq1 and qq2, written into out."""
+        for i in prange(Q1.shape[0]):
+            s = 0
+            for j in range(Q1.shape[1]):
+                s += np.int32(Q1[i, j]) * np.int32(Q2[i, j])
+            out[i] = 1.0 - s / np.sqrt(qq1[i] * qq2[i])
+    
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _top_k_similarities(Q1, Q2, qq1, qq2, out_idx, out_sim):
+        """Top-k cosine similarities of each Q1 row against all Q2 rows, best first.
+        
+        Keeps a sorted k-slot buffer per row instead of materializing the (N1, N2) matrix.
+        """
+        k = out_idx.shape[1]
+        for i in prange(Q1.shape[0]):
+            for t in range(k):
+                out_sim[i, t] = -np.inf
+                out_idx[i, t] = -1
+            for j in range(Q2.shape[0]):
+                s = 0
+                for d in range(Q1.shape[1]):
+                    s += np.int32(Q1[i, d]) * np.int32(Q2[j, d])
+                sim = s / np.sqrt(qq1[i] * qq2[j])
+                if sim <= out_sim[i, k - 1]:
+                    continue
+                t = k - 1
+                while t > 0 and out_sim[i, t - 1] < sim:
+                    out_sim[i, t] = out_sim[i, t - 1]
+                    out_idx[i, t] = out_idx[i, t - 1]
+                    t -= 1
+                out_sim[i, t] = sim
+                out_idx[i, t] = j
+
+def warm_distance_kernels():
+    """Compile the Numba distance kernels for the argument types the routes pass them."""
+    # Embedding matrices are read-only memmaps, which Numba types separately from writable arrays
+    Q = np.zeros((2, 8), dtype=np.int8)
+    Q.setflags(write=False)
+    qnorms_sq = np.ones(2, dtype=np.float64)
+    _cosine_distances(Q, Q, qnorms_sq, qnorms_sq, np.empty(2, dtype=np.float32))
+    _top_k_similarities(Q, Q, qnorms_sq, qnorms_sq, np.empty((2, 1), dtype=np.int64), np.empty((2, 1), dtype=np.float32))
+
+def normalize_embedding_matrix(matrix: np.ndarray) -> np.ndarray:
+    """Scale each embedding row to unit L2 norm in place, returning the original row norms."""
+    norms = np.linalg.norm(matrix, axis=1)
+    matrix /= norms[:, np.newaxis] + 1e-12
+    return norms
+
+def quantize_embedding_matrix(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize unit-norm embedding rows to int8 with a per-row scale."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.round(matrix / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+def dequantize_embedding_matrix(quantized: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Rebuild approximate float32 embedding rows from their int8 quantization."""
+    return quantized.astype(np.float32) * scales[:, np.newaxis]
+
+def embedding_mmap_path(embedding_id: str) -> str:
+    """Fresh path for an embedding's memory-mapped matrix file.
+    
+    Each mapping gets its own file, so removing an old one never deletes a matrix
+    that was reloaded for the same embedding in the meantime.
+    """
+    return os.path.join(EMBEDDING_MMAP_DIR, f"{embedding_id}-{uuid.uuid4().hex}.npy")
+
+def mmap_embedding_matrix(embedding_id: str, quantized: np.ndarray) -> np.memmap:
+    """Write a quantized embedding matrix to the local mmap directory and map it read-only."""
+    path = embedding_mmap_path(embedding_id)
+    # Write to a temp file and rename so a matrix that is already mapped is never truncated
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(quantized))
+    os.replace(tmp_path, path)
+    # The .npy header records dtype and shape, so the file maps back without side metadata
+    return np.load(path, mmap_mode='r')
+
+def remove_embedding_mmap(embed_data: Dict[str, Any]):
+    """Delete the file backing an entry's memory-mapped matrix; existing mappings stay valid."""
+    path = getattr(embed_data.get("matrix"), "filename", None)
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def clear_embedding_mmap_dir():
+    """Delete every matrix file in the mmap directory; files never outlive the process that mapped them."""
+    for name in os.listdir(EMBEDDING_MMAP_DIR):
+        if name.endswith((".npy", ".tmp")):
             try:
-                s3_client.abort_multipart_upload(
-                    Bucket=S3_BUCKET_NAME,
-                    Key=file_key,
-                    UploadId=upload_id
-                )
-            except:
+                os.remove(os.path.join(EMBEDDING_MMAP_DIR, name))
+            except FileNotFoundError:
                 pass
-            raise e
-        
+
+def quantized_squared_norms(quantized: np.ndarray) -> np.ndarray:
+    """Squared L2 norms of the int8 rows themselves, so cosine comes out exact for the quantized vectors.
+    
+    Kept as float64: the products of two of them stay exact integers, so sqrt(qq * qq) == qq
+    and identical rows get a distance of exactly zero.
+    """
+    qnorms_sq = np.einsum('ij,ij->i', quantized, quantized, dtype=np.int32).astype(np.float64)
+    qnorms_sq[qnorms_sq == 0] = 1.0
+    return qnorms_sq
+
+def get_dequantized_matrix(embedding_id: str, embed_data: Dict[str, Any]) -> np.ndarray:
+    """Get an embedding's unit-norm float32 rows, dequantizing once and reusing them on later calls."""
+    with dequantized_lock:
+        matrix = dequantized_storage.get(embedding_id)
+    if matrix is None:
+        matrix = dequantize_embedding_matrix(embed_data["matrix"], (1.0 / np.sqrt(embed_data["qnorms_sq"])).astype(np.float32))
+        with dequantized_lock:
+            dequantized_storage[embedding_id] = matrix
+    return matrix
+
+def index_embedding_matrix(quantized: np.ndarray, scales: np.ndarray) -> Dict[str, Any]:
+    """Build the derived lookup structures cached alongside a quantized embedding matrix."""
+    return {
+        "matrix": quantized,
+        "scales": scales,
+        "qnorms_sq": quantized_squared_norms(quantized),
+        "fingerprint": hashlib.blake2b(quantized.tobytes() + scales.tobytes(), digest_size=16).digest()
+    }
+
+def compute_segment_differences(embed_data1: Dict[str, Any], embed_data2: Dict[str, Any],
+                                threshold: float, distance_metric: str,
+                                merge_adjacent: bool = False) -> Tuple[List[Dict[str, Any]], np.ndarray, int, int]:
+    """Compare two completed embeddings segment by segment.
+    
+    Returns the segments whose distance exceeds threshold (plus the longer video's
+    trailing segments), the array of distances for every compared pair, and the number of
+    compared segments over the threshold and of trailing segments. With merge_adjacent,
+    runs of consecutive differing segments are returned as one entry carrying the
+    run's largest distance.
+    """
+    starts1, ends1 = embed_data1["starts"], embed_data1["ends"]
+    starts2, ends2 = embed_data2["starts"], embed_data2["ends"]
+    num_segments1, num_segments2 = len(starts1), len(starts2)
+    min_segments = min(num_segments1, num_segments2)
+    
+    # Compare corresponding int8 segment embeddings all at once, normalizing by the
+    # int8 rows' own norms so identical segments come out at exactly zero
+    Q1 = embed_data1["matrix"][:min_segments]
+    Q2 = embed_data2["matrix"][:min_segments]
+    qq1 = embed_data1["qnorms_sq"][:min_segments]
+    qq2 = embed_data2["qnorms_sq"][:min_segments]
+    
+    if NUMBA_AVAILABLE:
+        cosine_dists = np.empty(min_segments, dtype=np.float32)
+        _cosine_distances(Q1, Q2, qq1, qq2, cosine_dists)
+    else:
+        cosine_dists = (1.0 - np.einsum('ij,ij->i', Q1, Q2, dtype=np.int32) / np.sqrt(qq1 * qq2)).astype(np.float32)
+    
+    if distance_metric == "cosine":
+        # Cosine distance
+        dists = cosine_dists
+    else:
+        # Euclidean distance from the stored norms: |a-b|^2 = (|a|-|b|)^2 + 2|a||b|(1-cos),
+        # accumulated in place into one buffer
+        n1 = embed_data1["norms"][:min_segments]
+        n2 = embed_data2["norms"][:min_segments]
+        dists = np.multiply(n1, n2)
+        dists *= cosine_dists
+        dists *= 2.0
+        norm_diff = np.subtract(n1, n2)
+        norm_diff *= norm_diff
+        dists += norm_diff
+        np.maximum(dists, 0.0, out=dists)
+        np.sqrt(dists, out=dists)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        segment_pairs = zip(starts1.tolist(), ends1.tolist(), starts2.tolist(), ends2.tolist(), dists.tolist())
+        for i, (start1, end1, start2, end2, dist) in enumerate(segment_pairs):
+            logger.debug("Segment %d: Video1 %s-%ss vs Video2 %s-%ss, distance %.4f (threshold: %s)",
+                         i, start1, end1, start2, end2, dist, threshold)
+    
+    # Only segments that exceed the threshold become Python objects
+    over = np.nonzero(dists > threshold)[0]
+    actual_differing = len(over)
+    if merge_adjacent and actual_differing:
+        # Split the over-threshold indices wherever they stop being consecutive
+        run_offsets = np.concatenate(([0], np.nonzero(np.diff(over) != 1)[0] + 1))
+        run_firsts = over[run_offsets]
+        run_lasts = over[np.append(run_offsets[1:], actual_differing) - 1]
+        run_dists = np.maximum.reduceat(dists[over], run_offsets)
+        segment_columns = (starts1[run_firsts], ends1[run_lasts], run_dists)
+    else:
+        segment_columns = (starts1[over], ends1[over], dists[over])
+    differing_segments = [{
+        "start_sec": start,
+        "end_sec": end,
+        "distance": dist
+    } for start, end, dist in zip(*(column.tolist() for column in segment_columns))]
+    logger.info("Compared %d segments, %d over threshold %s", min_segments, actual_differing, threshold)
+    
+    # Only add remaining segments if they don't overlap with existing ones
+    extra_segments = 0
+    if num_segments1 != num_segments2:
+        # Segments from the longer video past the shorter one's end
+        if num_segments1 > num_segments2:
+            extra_starts, extra_ends = starts1[num_segments2:], ends1[num_segments2:]
+        else:
+            extra_starts, extra_ends = starts2[num_segments1:], ends2[num_segments1:]
+        
+        # Compared segments are in time order and don't overlap (nor do the extra ones
+        # among themselves), so the only candidate overlap is the last compared segment
+        # starting before the extra segment ends
+        existing_starts = [d["start_sec"] for d in differing_segments]
+        existing_ends = [d["end_sec"] for d in differing_segments]
+        previous_kept = None
+        for k, (start, end) in enumerate(zip(extra_starts.tolist(), extra_ends.tolist())):
+            j = bisect.bisect_left(existing_starts, end) - 1
+            if j >= 0 and existing_ends[j] > start:
+                continue
+            
+            extra_segments += 1
+            if merge_adjacent and previous_kept == k - 1:
+                differing_segments[-1]["end_sec"] = end
+            else:
+                differing_segments.append({
+                    "start_sec": start,
+                    "end_sec": end,
+                    "distance": 999999.0  # Use large number instead of infinity
+                })
+            previous_kept = k
+    
+    return differing_segments, dists, actual_differing, extra_segments
+
+def search_similar_segments(embedding_id1: str, embed_data1: Dict[str, Any],
+                            embedding_id2: str, embed_data2: Dict[str, Any], k: int) -> List[Dict[str, Any]]:
+    """Find the k most similar video 2 segments for every video 1 segment, best first.
+    
+    Both paths score the int8 rows by exact cosine, so results don't depend on Numba being installed.
+    """
+    if NUMBA_AVAILABLE:
+        indices = np.empty((len(embed_data1["starts"]), k), dtype=np.int64)
+        similarities = np.empty((len(embed_data1["starts"]), k), dtype=np.float32)
+        _top_k_similarities(embed_data1["matrix"], embed_data2["matrix"],
+                            embed_data1["qnorms_sq"], embed_data2["qnorms_sq"], indices, similarities)
+    else:
+        queries = get_dequantized_matrix(embedding_id1, embed_data1)
+        sims = queries @ get_dequantized_matrix(embedding_id2, embed_data2).T
+        indices = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        similarities = np.take_along_axis(sims, indices, axis=1)
+        order = np.argsort(-similarities, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        similarities = np.take_along_axis(similarities, order, axis=1)
+    
+    starts1, ends1 = embed_data1["starts"].tolist(), embed_data1["ends"].tolist()
+    starts2, ends2 = embed_data2["starts"].tolist(), embed_data2["ends"].tolist()
+    
+    segments = [{
+        "start_sec": starts1[i],
+        "end_sec": ends1[i],
+        "matches": [{
+            "segment_index": j,
+            "start_sec": starts2[j],
+            "end_sec": ends2[j],
+            "similarity": similarity
+        } for j, similarity in zip(index_row, similarity_row)]
+    } for i, (index_row, similarity_row) in enumerate(zip(indices.tolist(), similarities.tolist()))]
+    
+    return segments
+
+def persist_embedding(embedding_id: str, embed_data: Dict[str, Any]):
+    """Save a completed embedding's arrays and metadata to S3 so it can be reloaded later."""
+    if not s3_client:
+        return
+    
+    try:
+        metadata = {field: embed_data.get(field) for field in PERSISTED_EMBEDDING_FIELDS}
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            matrix=embed_data["matrix"],
+            scales=embed_data["scales"],
+            norms=embed_data["norms"],
+            starts=embed_data["starts"],
+            ends=embed_data["ends"],
+            metadata=np.array(json.dumps(metadata))
+        )
+        s3_client.put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=f"{EMBEDDING_CACHE_PREFIX}/{embedding_id}.npz",
+            Body=buffer.getvalue()
+        )
+        embed_data["persisted"] = True
+        logger.info(f"Persisted embedding {embedding_id} to S3")
+    except Exception as e:
+        logger.error(f"Failed to persist embedding {embedding_id}: {e}")
+
+def release_embedding(embedding_id: str, embed_data: Dict[str, Any]):
+    """Persist an evicted embedding if needed, then drop its local matrix file."""
+    try:
+        if not embed_data.get("persisted"):
+            persist_embedding(embedding_id, embed_data)
+        remove_embedding_mmap(embed_data)
+    finally:
+        if evicted_embeddings.get(embedding_id) is embed_data:
+            evicted_embeddings.pop(embedding_id, None)
+
+def load_persisted_embedding(embedding_id: str) -> Optional[Dict[str, Any]]:
+    """Load an embedding previously saved by persist_embedding, or None if there isn't one."""
+    try:
+        response = s3_client.get_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=f"{EMBEDDING_CACHE_PREFIX}/{embedding_id}.npz"
+        )
     except ClientError as e:
-        logger.error(f"Failed to upload file to S3: {e}")
-        raise Exception(f"S3 upload failed: {str(e)}")
+        # Without s3:ListBucket, S3 reports a missing key as 403 rather than 404
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "AccessDenied", "403"):
+            return None
+        raise
+    
+    with np.load(io.BytesIO(response["Body"].read())) as data:
+        metadata = json.loads(str(data["metadata"]))
+        embed_data = {
+            **metadata,
+            "status": "completed",
+            "starts": data["starts"],
+            "ends": data["ends"],
+            "norms": data["norms"],
+            **index_embedding_matrix(mmap_embedding_matrix(embedding_id, data["matrix"]), data["scales"]),
+            "persisted": True
+        }
+    
+    logger.info(f"Reloaded embedding {embedding_id} from S3")
+    return embed_data
+
+def lookup_embedding(embedding_id: str) -> Optional[Dict[str, Any]]:
+    """Get an in-flight or cached embedding entry without reloading from S3."""
+    embed_data = embedding_jobs.get(embedding_id)
+    if embed_data is None:
+        embed_data = embedding_storage.get(embedding_id)
+    if embed_data is None:
+        embed_data = evicted_embeddings.get(embedding_id)
+    return embed_data
+
+def finish_embedding_job(embedding_id: str):
+    """Move a finished job from embedding_jobs into the evictable embedding cache."""
+    embed_data = embedding_jobs.pop(embedding_id, None)
+    if embed_data is not None:
+        embedding_storage[embedding_id] = embed_data
+
+async def reload_embedding(embedding_id: str) -> Optional[Dict[str, Any]]:
+    """Reload an evicted embedding from S3 into the cache, remembering ids that aren't there."""
+    try:
+        embed_data = await asyncio.to_thread(load_persisted_embedding, embedding_id)
+    except ClientError as e:
+        logger.error(f"Failed to reload embedding {embedding_id}: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to load embedding: {str(e)}")
+    
+    if embed_data is None:
+        missing_embeddings[embedding_id] = True
+    else:
+        embedding_storage[embedding_id] = embed_data
+    return embed_data
+
+async def get_embedding_data(embedding_id: str) -> Optional[Dict[str, Any]]:
+    """Get embedding data from the in-memory cache, reloading it from S3 if it was evicted."""
+    embed_data = lookup_embedding(embedding_id)
+    if embed_data is not None or not s3_client or embedding_id in missing_embeddings:
+        return embed_data
+    
+    # Concurrent misses for the same id wait on a single reload
+    reload = embedding_reloads.get(embedding_id)
+    if reload is None:
+        reload = asyncio.create_task(reload_embedding(embedding_id))
+        embedding_reloads[embedding_id] = reload
+        reload.add_done_callback(lambda _: embedding_reloads.pop(embedding_id, None))
+    return await asyncio.shield(reload)
 
 def get_twelve_labs_client(api_key: str):
     """Get or create TwelveLabs client."""
@@ -306,14 +858,7 @@ def get_twelve_labs_client(api_key: str):
     try:
         tl_client = TwelveLabs(api_key=api_key)
         current_api_key = api_key
-        
-        # Save API key hash and the actual key
-        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute('INSERT OR REPLACE INTO api_keys (key_hash, api_key) VALUES (?, ?)', 
-                     (key_hash, api_key))
-        conn.commit()
-        conn.close()
+        store_api_key(api_key)
         
         logger.info("Successfully initialized TwelveLabs client")
         return tl_client
@@ -321,12 +866,25 @@ def get_twelve_labs_client(api_key: str):
         logger.error(f"Error initializing TwelveLabs client: {e}")
         raise HTTPException(status_code=401, detail="Invalid API key")
 
+def store_api_key(api_key: str):
+    """Save the API key and its hash, skipping the write if it is already the latest stored key."""
+    global last_stored_key
+    
+    if last_stored_key == api_key:
+        return
+    
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    with db_connection() as conn:
+        conn.execute('INSERT OR REPLACE INTO api_keys (key_hash, api_key) VALUES (?, ?)', 
+                     (key_hash, api_key))
+        conn.commit()
+    last_stored_key = api_key
+
 def get_stored_api_key() -> str:
     """Get the stored API key from database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.execute('SELECT api_key FROM api_keys ORDER BY created_at DESC LIMIT 1')
-    stored_api_key = cursor.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.execute('SELECT api_key FROM api_keys ORDER BY created_at DESC LIMIT 1')
+        stored_api_key = cursor.fetchone()
     
     if not stored_api_key or not stored_api_key[0]:
         raise HTTPException(status_code=400, detail="No API key found. Please validate your API key first.")
@@ -334,26 +892,31 @@ def get_stored_api_key() -> str:
     return stored_api_key[0]
 
 # Async functions
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking SDK call on the shared thread pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(sdk_executor, functools.partial(func, *args, **kwargs))
+
 async def generate_embeddings_async(embedding_id: str, s3_url: str, api_key: str):
     """Asynchronously generate embeddings for a video from S3."""
-    global processing_video
-    
+    embed_data = embedding_jobs[embedding_id]
     try:
-        logger.info(f"Starting async embedding generation for {embedding_id}")
+        logger.info("Starting async embedding generation for %s", embedding_id)
         
         # Update status
-        embedding_storage[embedding_id]["status"] = "processing"
+        embed_data["status"] = "processing"
         
         # Get TwelveLabs client
         tl = get_twelve_labs_client(api_key)
         
         # Generate presigned URL for TwelveLabs to access the video
-        logger.info(f"Generating presigned URL for {embedding_id}")
-        presigned_url = get_s3_presigned_url(s3_url)
+        logger.info("Generating presigned URL for %s", embedding_id)
+        presigned_url = await run_blocking(get_s3_presigned_url, s3_url)
         
         # Create embedding task using presigned HTTPS URL
-        logger.info(f"Creating embedding task for {embedding_id}")
-        task = tl.embed.task.create(
+        logger.info("Creating embedding task for %s", embedding_id)
+        task = await run_blocking(
+            tl.embed.task.create,
             model_name="Marengo-retrieval-2.7",
             video_url=presigned_url,
             video_clip_length=2,
@@ -363,30 +926,29 @@ async def generate_embeddings_async(embedding_id: str, s3_url: str, api_key: str
         # Store task for potential cancellation
         active_tasks[embedding_id] = task
         
-        logger.info(f"Embedding task {task.id} created for {embedding_id}")
+        logger.info("Embedding task %s created for %s", task.id, embedding_id)
         
         # Wait for completion
         def on_task_update(task: EmbeddingsTask):
-            logger.info(f"Task {task.id} status: {task.status}")
+            logger.info("Task %s status: %s", task.id, task.status)
         
         # Add timeout for very long videos (over 15 minutes)
         # TwelveLabs might have issues with extremely long videos
         timeout_seconds = 1800  # 30 minutes default
-        logger.info(f"Starting to wait for task {task.id} completion with timeout: {timeout_seconds}s")
+        logger.info("Starting to wait for task %s completion with timeout: %ss", task.id, timeout_seconds)
         
         try:
-            task.wait_for_done(sleep_interval=5, callback=on_task_update, timeout=timeout_seconds)
-            logger.info(f"Task {task.id} completed, retrieving results...")
+            await run_blocking(task.wait_for_done, sleep_interval=5, callback=on_task_update, timeout=timeout_seconds)
+            logger.info("Task %s completed, retrieving results...", task.id)
         except Exception as e:
-            logger.error(f"Task {task.id} timed out or failed during wait: {e}")
+            logger.error("Task %s timed out or failed during wait: %s", task.id, e)
             raise Exception(f"Embedding task timed out after {timeout_seconds}s")
         
         # Remove from active tasks
-        if embedding_id in active_tasks:
-            del active_tasks[embedding_id]
+        active_tasks.pop(embedding_id, None)
         
         # Get completed task
-        completed_task = tl.embed.task.retrieve(task.id)
+        completed_task = await run_blocking(tl.embed.task.retrieve, task.id)
         
         # Validate that the task actually succeeded
         if completed_task.status != "ready":
@@ -394,24 +956,24 @@ async def generate_embeddings_async(embedding_id: str, s3_url: str, api_key: str
         
         # Check if we have embeddings
         if not completed_task.video_embedding:
-            logger.error(f"Task {completed_task.id} completed but no video_embedding found")
-            logger.error(f"Task status: {completed_task.status}")
-            logger.error(f"Task error: {getattr(completed_task, 'error', 'No error field')}")
+            logger.error("Task %s completed but no video_embedding found", completed_task.id)
+            logger.error("Task status: %s", completed_task.status)
+            logger.error("Task error: %s", getattr(completed_task, 'error', 'No error field'))
             raise Exception(f"Task {completed_task.id} completed but no video_embedding found")
         
         if not completed_task.video_embedding.segments:
-            logger.error(f"Task {completed_task.id} completed but no segments found in video_embedding")
-            logger.error(f"Video embedding object: {completed_task.video_embedding}")
-            logger.error(f"Video embedding type: {type(completed_task.video_embedding)}")
-            logger.error(f"Video embedding attributes: {dir(completed_task.video_embedding)}")
+            logger.error("Task %s completed but no segments found in video_embedding", completed_task.id)
+            logger.error("Video embedding object: %s", completed_task.video_embedding)
+            logger.error("Video embedding type: %s", type(completed_task.video_embedding))
+            logger.error("Video embedding attributes: %s", dir(completed_task.video_embedding))
             raise Exception(f"Task {completed_task.id} completed but no segments found in video_embedding")
         
         # Log successful embedding generation details
-        logger.info(f"Successfully generated embeddings for {embedding_id}")
-        logger.info(f"Task ID: {completed_task.id}")
-        logger.info(f"Task status: {completed_task.status}")
-        logger.info(f"Video embedding type: {type(completed_task.video_embedding)}")
-        logger.info(f"Number of segments: {len(completed_task.video_embedding.segments)}")
+        logger.info("Successfully generated embeddings for %s", embedding_id)
+        logger.info("Task ID: %s", completed_task.id)
+        logger.info("Task status: %s", completed_task.status)
+        logger.info("Video embedding type: %s", type(completed_task.video_embedding))
+        logger.info("Number of segments: %s", len(completed_task.video_embedding.segments))
         
         # Calculate duration from video metadata or segments
         duration = 0
@@ -422,110 +984,168 @@ async def generate_embeddings_async(embedding_id: str, s3_url: str, api_key: str
             
             # Log segment information for debugging
             total_segments = len(completed_task.video_embedding.segments)
-            logger.info(f"Video has {total_segments} segments")
-            logger.info(f"First segment: {completed_task.video_embedding.segments[0].start_offset_sec}s - {completed_task.video_embedding.segments[0].end_offset_sec}s")
-            logger.info(f"Last segment: {last_segment.start_offset_sec}s - {last_segment.end_offset_sec}s")
-            logger.info(f"Calculated duration: {duration}s")
+            logger.info("Video has %s segments", total_segments)
+            logger.info("First segment: %ss - %ss", completed_task.video_embedding.segments[0].start_offset_sec, completed_task.video_embedding.segments[0].end_offset_sec)
+            logger.info("Last segment: %ss - %ss", last_segment.start_offset_sec, last_segment.end_offset_sec)
+            logger.info("Calculated duration: %ss", duration)
             
             # Verify segment spacing is correct (should be 2 seconds apart)
             if total_segments > 1:
                 first_gap = completed_task.video_embedding.segments[1].start_offset_sec - completed_task.video_embedding.segments[0].start_offset_sec
-                logger.info(f"Segment spacing: {first_gap}s (should be 2s)")
+                logger.info("Segment spacing: %ss (should be 2s)", first_gap)
                 
             # Additional validation for long videos
             if duration > 600:  # 10 minutes
-                logger.info(f"Long video detected ({duration}s), validating segment count")
+                logger.info("Long video detected (%ss), validating segment count", duration)
                 expected_segments = duration / 2  # 2-second segments
                 if abs(total_segments - expected_segments) > 10:  # Allow some tolerance
-                    logger.warning(f"Segment count mismatch for long video. Expected ~{expected_segments}, got {total_segments}")
+                    logger.warning("Segment count mismatch for long video. Expected ~%s, got %s", expected_segments, total_segments)
                     
                 # Additional validation for very long videos
                 if duration > 900:  # 15 minutes
-                    logger.info(f"Very long video detected ({duration}s), performing additional validation")
+                    logger.info("Very long video detected (%ss), performing additional validation", duration)
                     if total_segments < 100:  # Should have at least 100 segments for a 15+ min video
-                        logger.error(f"Very long video has suspiciously few segments: {total_segments}")
-                        logger.error(f"This suggests the embedding generation may have failed")
+                        logger.error("Very long video has suspiciously few segments: %s", total_segments)
+                        logger.error("This suggests the embedding generation may have failed")
                         raise Exception(f"Very long video ({duration}s) has insufficient segments ({total_segments}) - embedding generation likely failed")
                     
                     # Check if segments cover the full duration
                     if last_segment.end_offset_sec < duration * 0.8:  # Should cover at least 80% of duration
-                        logger.error(f"Segments don't cover full video duration. Last segment ends at {last_segment.end_offset_sec}s, video is {duration}s")
+                        logger.error("Segments don't cover full video duration. Last segment ends at %ss, video is %ss", last_segment.end_offset_sec, duration)
                         raise Exception(f"Segments don't cover full video duration - embedding generation incomplete")
         else:
             raise Exception(f"No segments found in completed task {completed_task.id}")
         
+        # Store segments column-wise (offsets and embedding matrix) instead of keeping the SDK objects
+        segments = completed_task.video_embedding.segments
+        starts = np.fromiter((s.start_offset_sec for s in segments), dtype=np.float32, count=len(segments))
+        ends = np.fromiter((s.end_offset_sec for s in segments), dtype=np.float32, count=len(segments))
+        matrix = np.empty((len(segments), len(segments[0].embeddings_float)), dtype=np.float32)
+        for i, segment in enumerate(segments):
+            matrix[i] = segment.embeddings_float
+        
+        # Unit-normalize once so cosine similarity is a plain dot product; keep norms for euclidean
+        norms = normalize_embedding_matrix(matrix)
+        
+        # Keep int8 embeddings (a quarter of the float32 footprint) with per-row scales
+        quantized, scales = quantize_embedding_matrix(matrix)
+        if VERIFY_QUANTIZATION:
+            # Cosine error of each quantized row against its float32 original (1 - cos)
+            restored = dequantize_embedding_matrix(quantized, scales)
+            cosine_error = 1.0 - np.einsum('ij,ij->i', restored, matrix) / np.linalg.norm(restored, axis=1)
+            logger.info("Quantization error for %s - max: %.6f, mean: %.6f",
+                        embedding_id, cosine_error.max(), cosine_error.mean())
+        quantized = await asyncio.to_thread(mmap_embedding_matrix, embedding_id, quantized)
+        indexed = await asyncio.to_thread(index_embedding_matrix, quantized, scales)
+        
         # Update embedding storage
-        embedding_storage[embedding_id].update({
+        embed_data.update({
             "status": "completed",
-            "embeddings": completed_task.video_embedding,
+            "starts": starts,
+            "ends": ends,
+            "norms": norms,
+            **indexed,
             "duration": duration,
             "task_id": task.id,
             "completed_at": datetime.now().isoformat()
         })
         
         # Update video storage with duration
-        video_id = embedding_storage[embedding_id]["video_id"]
+        video_id = embed_data["video_id"]
         if video_id in video_storage:
             video_storage[video_id]["duration"] = duration
             video_storage[video_id]["status"] = "ready"
         
-        logger.info(f"Embedding generation completed for {embedding_id}")
-        
-        # Process next video in queue if available
-        if pending_videos:
-            next_video = pending_videos.pop(0)
-            logger.info(f"Starting processing for next video in queue: {next_video['video_id']}")
-            processing_video = next_video['video_id']
-            asyncio.create_task(generate_embeddings_async(
-                next_video['embedding_id'], 
-                next_video['s3_url'], 
-                next_video['api_key']
-            ))
-        else:
-            # No more videos to process
-            processing_video = None
-            logger.info("No more videos in queue, processing complete")
+        logger.info("Embedding generation completed for %s", embedding_id)
         
     except Exception as e:
-        logger.error(f"Error in async embedding generation for {embedding_id}: {e}")
-        embedding_storage[embedding_id]["status"] = "failed"
-        embedding_storage[embedding_id]["error"] = str(e)
+        logger.error("Error in async embedding generation for %s: %s", embedding_id, e)
+        embed_data["status"] = "failed"
+        embed_data["error"] = str(e)
         
         # Remove from active tasks
-        if embedding_id in active_tasks:
-            del active_tasks[embedding_id]
-        
-        # Even on error, try to process next video in queue
-        if pending_videos:
-            next_video = pending_videos.pop(0)
-            logger.info(f"Starting processing for next video in queue after error: {next_video['video_id']}")
-            processing_video = next_video['video_id']
-            asyncio.create_task(generate_embeddings_async(
-                next_video['embedding_id'], 
-                next_video['s3_url'], 
-                next_video['api_key']
-            ))
+        active_tasks.pop(embedding_id, None)
+    finally:
+        if embedding_id in embedding_jobs:
+            finish_embedding_job(embedding_id)
         else:
-            processing_video = None
-            logger.info("No more videos in queue after error, processing complete")
+            # The video was cancelled and removed while processing
+            remove_embedding_mmap(embed_data)
+
+async def embed_worker(worker_id: int):
+    """Persistent worker that generates embeddings for queued videos one at a time."""
+    while True:
+        job = await embed_queue.get()
+        try:
+            embed_data = embedding_jobs.get(job["embedding_id"])
+            if embed_data is None or embed_data["status"] != "pending":
+                logger.info(f"Skipping queued embedding {job['embedding_id']} (no longer pending)")
+                finish_embedding_job(job["embedding_id"])
+                continue
+            
+            logger.info(f"Worker {worker_id} starting processing for video {job['video_id']}")
+            await generate_embeddings_async(job["embedding_id"], job["s3_url"], job["api_key"])
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed processing {job['embedding_id']}: {e}")
+        finally:
+            embed_queue.task_done()
+
+@app.on_event("startup")
+async def clear_stale_embedding_mmaps():
+    """Delete matrix files left behind by a previous process; nothing maps them anymore."""
+    await asyncio.to_thread(clear_embedding_mmap_dir)
+
+@app.on_event("startup")
+async def start_embed_workers():
+    """Start the persistent embedding workers."""
+    for worker_id in range(EMBED_CONCURRENCY):
+        embed_workers.append(asyncio.create_task(embed_worker(worker_id)))
+    logger.info(f"Started {EMBED_CONCURRENCY} embedding workers")
+
+@app.on_event("startup")
+async def warm_numba_kernels():
+    """JIT-compile the Numba kernels up front so the first comparison doesn't pay for it."""
+    if NUMBA_AVAILABLE:
+        await asyncio.to_thread(warm_distance_kernels)
+        logger.info("Numba distance kernels compiled")
+
+@app.on_event("startup")
+async def record_start_time():
+    """Record the event loop clock at startup for uptime reporting."""
+    global start_monotonic
+    start_monotonic = asyncio.get_running_loop().time()
+
+@app.on_event("shutdown")
+async def flush_embedding_cache():
+    """Persist cached embeddings that haven't been saved yet and delete their local matrix files before shutting down."""
+    pending = [
+        (embedding_id, embed_data) for embedding_id, embed_data in list(embedding_storage.items())
+        if embed_data.get("status") == "completed" and not embed_data.get("persisted")
+    ]
+    for embedding_id, embed_data in pending:
+        persist_executor.submit(persist_embedding, embedding_id, embed_data)
+    await asyncio.to_thread(persist_executor.shutdown, wait=True)
+    await asyncio.to_thread(clear_embedding_mmap_dir)
+    sdk_executor.shutdown(wait=False, cancel_futures=True)
 
 # API endpoints
 @app.post("/validate-key", response_model=ApiKeyResponse)
 async def validate_api_key(request: ApiKeyRequest):
     """Validate TwelveLabs API key and store hash securely."""
     logger.info("Validating API key...")
+    key_digest = hashlib.sha256(request.key.encode()).digest()
+    if key_digest in validated_keys:
+        logger.info("API key validated recently, skipping live check")
+        store_api_key(request.key)
+        return ApiKeyResponse(key=request.key, isValid=True)
+    
     try:
         # Test the API key
         client = TwelveLabs(api_key=request.key)
-        client.task.list()  # Test API call
+        await asyncio.to_thread(client.task.list)  # Test API call
+        validated_keys[key_digest] = True
         
-        # Save API key hash and the actual key
-        key_hash = hashlib.sha256(request.key.encode()).hexdigest()
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute('INSERT OR REPLACE INTO api_keys (key_hash, api_key) VALUES (?, ?)', 
-                     (key_hash, request.key))
-        conn.commit()
-        conn.close()
+        store_api_key(request.key)
         
         logger.info("API key validation successful")
         return ApiKeyResponse(key=request.key, isValid=True)
@@ -533,10 +1153,127 @@ async def validate_api_key(request: ApiKeyRequest):
         logger.error(f"API key validation failed: {e}")
         return ApiKeyResponse(key=request.key, isValid=False)
 
+async def register_video(filename: str, s3_url: str, api_key: str) -> VideoUploadResponse:
+    """Store metadata for an uploaded video and queue its embedding generation."""
+    # Generate unique IDs
+    video_id = f"video_{uuid.uuid4()}"
+    embedding_id = f"embed_{uuid.uuid4()}"
+    logger.info(f"Generated IDs - Video: {video_id}, Embedding: {embedding_id}")
+    
+    # Store video metadata (in-memory only)
+    video_storage[video_id] = {
+        "filename": filename,
+        "s3_url": s3_url,
+        "status": "uploaded",
+        "upload_timestamp": datetime.now().isoformat(),
+        "embedding_id": embedding_id
+    }
+    
+    # Track the embedding job until it finishes (in-memory only)
+    embedding_jobs[embedding_id] = {
+        "filename": filename,
+        "status": "pending",
+        "video_id": video_id,
+        "s3_url": s3_url
+    }
+    
+    logger.info("Video and embedding data stored in memory")
+
+    # Hand the job to the embedding workers, refusing rather than waiting when the queue is full
+    try:
+        embed_queue.put_nowait({
+            "video_id": video_id,
+            "embedding_id": embedding_id,
+            "s3_url": s3_url,
+            "api_key": api_key
+        })
+    except asyncio.QueueFull:
+        video_storage.pop(video_id, None)
+        embedding_jobs.pop(embedding_id, None)
+        logger.warning(f"Embedding queue full, rejecting {filename}")
+        raise HTTPException(status_code=503, detail="Too many videos are waiting for processing. Please try again later.")
+    
+    logger.info(f"File {filename} queued for processing ({embed_queue.qsize()} jobs waiting)")
+    
+    return VideoUploadResponse(
+        message="Video uploaded successfully. Queued for embedding generation.",
+        filename=filename,
+        video_id=video_id,
+        embedding_id=embedding_id,
+        status="queued"
+    )
+
+@app.post("/create-upload-url", response_model=UploadUrlResponse)
+async def create_upload_url(request: UploadUrlRequest):
+    """Create a presigned POST so the client can upload a video directly to S3."""
+    if not request.content_type.startswith('video/'):
+        raise HTTPException(status_code=400, detail="File must be a video")
+    
+    if not s3_client:
+        raise HTTPException(status_code=503, detail="S3 client not initialized")
+    
+    # Registering the upload needs a key, so refuse before the client sends the whole file
+    get_stored_api_key()
+    
+    file_key = f"videos/{uuid.uuid4()}_{request.filename}"
+    
+    try:
+        presigned_post = await asyncio.to_thread(
+            s3_client.generate_presigned_post,
+            Bucket=S3_BUCKET_NAME,
+            Key=file_key,
+            Fields={'Content-Type': request.content_type},
+            Conditions=[
+                ['starts-with', '$Content-Type', 'video/'],
+                ['content-length-range', 0, MAX_UPLOAD_BYTES]
+            ],
+            ExpiresIn=3600
+        )
+    except ClientError as e:
+        logger.error(f"Failed to create presigned POST for {request.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to create upload URL: {str(e)}")
+    
+    logger.info(f"Created direct upload URL for {request.filename}")
+    return UploadUrlResponse(
+        url=presigned_post['url'],
+        fields=presigned_post['fields'],
+        s3_url=f"s3://{S3_BUCKET_NAME}/{file_key}"
+    )
+
+@app.post("/register-upload", response_model=VideoUploadResponse)
+async def register_upload(request: RegisterUploadRequest):
+    """Start embedding generation for a video the client uploaded directly to S3."""
+    if not request.s3_url.startswith(f"s3://{S3_BUCKET_NAME}/videos/"):
+        raise HTTPException(status_code=400, detail="Invalid S3 URL")
+    
+    if not s3_client:
+        raise HTTPException(status_code=503, detail="S3 client not initialized")
+    
+    # Make sure the upload actually landed before queuing work against it
+    file_key = request.s3_url[len(f"s3://{S3_BUCKET_NAME}/"):]
+    try:
+        await asyncio.to_thread(s3_client.head_object, Bucket=S3_BUCKET_NAME, Key=file_key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=400, detail="Uploaded video not found in S3")
+        logger.error(f"Failed to check upload {request.s3_url}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to check upload: {str(e)}")
+    
+    api_key = get_stored_api_key()
+    
+    try:
+        return await register_video(request.filename, request.s3_url, api_key)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error registering upload {request.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to register upload: {str(e)}")
+
 @app.post("/upload-and-generate-embeddings", response_model=VideoUploadResponse)
 async def upload_and_generate_embeddings(file: UploadFile = File(...)):
-    """Upload video file and start AI embedding generation."""
-    global processing_video
+    """Upload video file through the backend and start AI embedding generation."""
+    if not ENABLE_LEGACY_UPLOAD:
+        raise HTTPException(status_code=410, detail="Proxied uploads are disabled. Use /create-upload-url instead.")
     
     logger.info(f"=== UPLOAD REQUEST RECEIVED ===")
     logger.info(f"File: {file.filename}")
@@ -547,6 +1284,11 @@ async def upload_and_generate_embeddings(file: UploadFile = File(...)):
         logger.error(f"Invalid content type: {file.content_type}")
         raise HTTPException(status_code=400, detail="File must be a video")
     
+    # Reject oversized files before any bytes are sent on to S3
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        logger.error(f"File too large: {file.size} bytes (limit {MAX_UPLOAD_BYTES})")
+        raise HTTPException(status_code=413, detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES} bytes")
+    
     try:
         logger.info(f"Starting upload for {file.filename}")
         
@@ -559,57 +1301,12 @@ async def upload_and_generate_embeddings(file: UploadFile = File(...)):
         s3_url = await upload_to_s3_streaming(file)
         logger.info(f"S3 upload completed: {s3_url}")
         
-        # Generate unique IDs
-        video_id = f"video_{uuid.uuid4()}"
-        embedding_id = f"embed_{uuid.uuid4()}"
-        logger.info(f"Generated IDs - Video: {video_id}, Embedding: {embedding_id}")
-        
-        # Store video metadata (in-memory only)
-        video_storage[video_id] = {
-            "filename": file.filename,
-            "s3_url": s3_url,
-            "status": "uploaded",
-            "upload_timestamp": datetime.now().isoformat(),
-            "embedding_id": embedding_id
-        }
-        
-        # Initialize embedding storage (in-memory only)
-        embedding_storage[embedding_id] = {
-            "filename": file.filename,
-            "status": "pending",
-            "video_id": video_id,
-            "s3_url": s3_url
-        }
-        
-        logger.info("Video and embedding data stored in memory")
-
-        # Check if we can start processing immediately or need to queue
-        if processing_video is None:
-            # No video currently processing, start immediately
-            logger.info("Starting embedding generation immediately...")
-            processing_video = video_id
-            asyncio.create_task(generate_embeddings_async(embedding_id, s3_url, api_key))
-        else:
-            # Another video is processing, add to queue
-            logger.info(f"Video {video_id} queued, waiting for {processing_video} to complete")
-            pending_videos.append({
-                "video_id": video_id,
-                "embedding_id": embedding_id,
-                "s3_url": s3_url,
-                "api_key": api_key
-            })
-        
+        response = await register_video(file.filename, s3_url, api_key)
         logger.info(f"=== UPLOAD COMPLETED SUCCESSFULLY ===")
-        logger.info(f"File {file.filename} uploaded to S3 and {'embedding generation started' if processing_video == video_id else 'queued for processing'}")
-        
-        return VideoUploadResponse(
-            message="Video uploaded successfully. Embedding generation in progress." if processing_video == video_id else "Video uploaded successfully. Waiting for previous video to complete.",
-            filename=file.filename,
-            video_id=video_id,
-            embedding_id=embedding_id,
-            status="processing" if processing_video == video_id else "queued"
-        )
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"=== UPLOAD FAILED ===")
         logger.error(f"Error uploading file {file.filename}: {e}")
@@ -623,19 +1320,19 @@ async def cancel_embedding_task(request: CancelTaskRequest):
     """Cancel an active embedding task."""
     embedding_id = request.embedding_id
     
-    if embedding_id not in active_tasks:
+    # Claim the task in a single step so a finishing worker can't race the lookup
+    task = active_tasks.pop(embedding_id, None)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found or already completed")
     
     try:
-        task = active_tasks[embedding_id]
         logger.info(f"Cancelling embedding task {task.id} for {embedding_id}")
         
         # Update status to cancelled
-        embedding_storage[embedding_id]["status"] = "cancelled"
-        embedding_storage[embedding_id]["error"] = "Task cancelled by user"
-        
-        # Remove from active tasks
-        del active_tasks[embedding_id]
+        embed_data = lookup_embedding(embedding_id)
+        if embed_data is not None:
+            embed_data["status"] = "cancelled"
+            embed_data["error"] = "Task cancelled by user"
         
         logger.info(f"Successfully cancelled embedding task for {embedding_id}")
         return {"message": "Task cancelled successfully"}
@@ -657,8 +1354,8 @@ async def generate_openai_analysis(request: OpenAIAnalysisRequest):
         openai.api_key = openai_api_key
         
         # Get video information
-        embed_data1 = embedding_storage.get(request.embedding_id1)
-        embed_data2 = embedding_storage.get(request.embedding_id2)
+        embed_data1 = await get_embedding_data(request.embedding_id1)
+        embed_data2 = await get_embedding_data(request.embedding_id2)
         
         if not embed_data1 or not embed_data2:
             raise HTTPException(status_code=404, detail="Embedding data not found")
@@ -727,20 +1424,21 @@ async def generate_openai_analysis(request: OpenAIAnalysisRequest):
         logger.error(f"Error generating OpenAI analysis: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate analysis: {str(e)}")
 
-@app.post("/compare-local-videos", response_model=ComparisonResponse)
+@app.post("/compare-local-videos", response_model=ComparisonResponse, response_class=ORJSONResponse)
 async def compare_local_videos(
     embedding_id1: str = Query(...),
     embedding_id2: str = Query(...),
     threshold: float = Query(0.1),
-    distance_metric: str = Query("cosine")
+    distance_metric: str = Query("cosine"),
+    merge_adjacent: bool = Query(False)
 ):
     """Compare two videos using their embedding IDs."""
     try:
-        if embedding_id1 not in embedding_storage or embedding_id2 not in embedding_storage:
-            raise HTTPException(status_code=404, detail="Embeddings not found")
+        embed_data1 = await get_embedding_data(embedding_id1)
+        embed_data2 = await get_embedding_data(embedding_id2)
         
-        embed_data1 = embedding_storage[embedding_id1]
-        embed_data2 = embedding_storage[embedding_id2]
+        if embed_data1 is None or embed_data2 is None:
+            raise HTTPException(status_code=404, detail="Embeddings not found")
         
         # Check if embeddings are ready
         if embed_data1["status"] != "completed":
@@ -749,251 +1447,196 @@ async def compare_local_videos(
         if embed_data2["status"] != "completed":
             raise HTTPException(status_code=400, detail=f"Embedding {embedding_id2} is not ready. Status: {embed_data2['status']}")
         
-        # Get actual embedding segments from TwelveLabs
-        segments1 = []
-        segments2 = []
-        
-        if embed_data1["embeddings"] and embed_data1["embeddings"].segments:
-            segments1 = [{
-                "start_offset_sec": seg.start_offset_sec,
-                "end_offset_sec": seg.end_offset_sec,
-                "embedding": seg.embeddings_float
-            } for seg in embed_data1["embeddings"].segments]
-            logger.info(f"Video1 segments extracted: {len(segments1)}")
-        else:
-            logger.error(f"Video1 has no embeddings or segments! Embeddings object: {embed_data1.get('embeddings')}")
-        
-        if embed_data2["embeddings"] and embed_data2["embeddings"].segments:
-            segments2 = [{
-                "start_offset_sec": seg.start_offset_sec,
-                "end_offset_sec": seg.end_offset_sec,
-                "embedding": seg.embeddings_float
-            } for seg in embed_data2["embeddings"].segments]
-            logger.info(f"Video2 segments extracted: {len(segments2)}")
-        else:
-            logger.error(f"Video2 has no embeddings or segments! Embeddings object: {embed_data2.get('embeddings')}")
+        # Identical embeddings can't differ anywhere, so skip the distance computation
+        if embedding_id1 == embedding_id2 or embed_data1["fingerprint"] == embed_data2["fingerprint"]:
+            logger.info("Embeddings %s and %s are identical, skipping comparison", embedding_id1, embedding_id2)
+            return ORJSONResponse({
+                "filename1": embed_data1["filename"],
+                "filename2": embed_data2["filename"],
+                "differences": [],
+                "total_segments": len(embed_data1["starts"]),
+                "differing_segments": 0,
+                "threshold_used": threshold
+            })
+        
+        # Segment offsets cached column-wise when the embeddings completed
+        starts1, ends1 = embed_data1["starts"], embed_data1["ends"]
+        starts2, ends2 = embed_data2["starts"], embed_data2["ends"]
+        num_segments1, num_segments2 = len(starts1), len(starts2)
         
         # Validate segment data integrity
-        if segments1:
-            logger.info(f"Video1 first segment: {segments1[0]}")
-            logger.info(f"Video1 last segment: {segments1[-1]}")
-        if segments2:
-            logger.info(f"Video2 first segment: {segments2[0]}")
-            logger.info(f"Video2 last segment: {segments2[-1]}")
-        
-        logger.info(f"Comparing {len(segments1)} segments from video1 with {len(segments2)} segments from video2, threshold: {threshold}")
-        
-        # Log first few and last few segments for debugging (don't log all for large videos)
-        if len(segments1) > 0:
-            first_segments1 = segments1[:3]
-            last_segments1 = segments1[-3:] if len(segments1) > 3 else []
-            logger.info(f"Video1 first 3 segments: {[(s['start_offset_sec'], s['end_offset_sec']) for s in first_segments1]}")
-            if last_segments1:
-                logger.info(f"Video1 last 3 segments: {[(s['start_offset_sec'], s['end_offset_sec']) for s in last_segments1]}")
-        
-        if len(segments2) > 0:
-            first_segments2 = segments2[:3]
-            last_segments2 = segments2[-3:] if len(segments2) > 3 else []
-            logger.info(f"Video2 first 3 segments: {[(s['start_offset_sec'], s['end_offset_sec']) for s in first_segments2]}")
-            if last_segments2:
-                logger.info(f"Video2 last 3 segments: {[(s['start_offset_sec'], s['end_offset_sec']) for s in last_segments2]}")
-        
-        logger.info(f"Embedding data1 keys: {list(embed_data1.keys())}")
-        logger.info(f"Embedding data2 keys: {list(embed_data2.keys())}")
-        logger.info(f"Embedding1 has embeddings: {embed_data1.get('embeddings') is not None}")
-        logger.info(f"Embedding2 has embeddings: {embed_data2.get('embeddings') is not None}")
+        if num_segments1:
+            logger.info("Video1 first segment: %s-%ss", starts1[0], ends1[0])
+            logger.info("Video1 last segment: %s-%ss", starts1[-1], ends1[-1])
+        if num_segments2:
+            logger.info("Video2 first segment: %s-%ss", starts2[0], ends2[0])
+            logger.info("Video2 last segment: %s-%ss", starts2[-1], ends2[-1])
+        
+        logger.info("Comparing %s segments from video1 with %s segments from video2, threshold: %s", num_segments1, num_segments2, threshold)
+        
+        # Log first few and last few segments for debugging (don't log all for large videos);
+        # the arguments are built eagerly, so skip them entirely when INFO is off
+        if logger.isEnabledFor(logging.INFO):
+            if num_segments1 > 0:
+                logger.info("Video1 first 3 segments: %s", list(zip(starts1[:3].tolist(), ends1[:3].tolist())))
+                if num_segments1 > 3:
+                    logger.info("Video1 last 3 segments: %s", list(zip(starts1[-3:].tolist(), ends1[-3:].tolist())))
+            
+            if num_segments2 > 0:
+                logger.info("Video2 first 3 segments: %s", list(zip(starts2[:3].tolist(), ends2[:3].tolist())))
+                if num_segments2 > 3:
+                    logger.info("Video2 last 3 segments: %s", list(zip(starts2[-3:].tolist(), ends2[-3:].tolist())))
+            
+            logger.info("Embedding data1 keys: %s", list(embed_data1.keys()))
+            logger.info("Embedding data2 keys: %s", list(embed_data2.keys()))
+            logger.info("Embedding1 has embeddings: %s", embed_data1.get('matrix') is not None)
+            logger.info("Embedding2 has embeddings: %s", embed_data2.get('matrix') is not None)
         
         # Get video durations for proper timeline handling
         duration1 = embed_data1.get("duration", 0)
         duration2 = embed_data2.get("duration", 0)
         max_duration = max(duration1, duration2)
         
-        logger.info(f"Video durations - Video1: {duration1}s, Video2: {duration2}s, Max: {max_duration}s")
+        logger.info("Video durations - Video1: %ss, Video2: %ss, Max: %ss", duration1, duration2, max_duration)
         
         # Validate segment data
-        if len(segments1) == 0:
-            logger.error(f"Video1 has no segments! Duration: {duration1}s")
+        if num_segments1 == 0:
+            logger.error("Video1 has no segments! Duration: %ss", duration1)
             raise HTTPException(status_code=400, detail=f"Video1 has no segments - embedding generation may have failed. Duration: {duration1}s")
-        if len(segments2) == 0:
-            logger.error(f"Video2 has no segments! Duration: {duration2}s")
+        if num_segments2 == 0:
+            logger.error("Video2 has no segments! Duration: %ss", duration2)
             raise HTTPException(status_code=400, detail=f"Video2 has no segments - embedding generation may have failed. Duration: {duration2}s")
         
         # Expected segment count based on duration
         expected_segments1 = max(1, int(duration1 / 2))  # 2-second segments
         expected_segments2 = max(1, int(duration2 / 2))
-        logger.info(f"Expected segments - Video1: {expected_segments1}, Video2: {expected_segments2}")
-        logger.info(f"Actual segments - Video1: {len(segments1)}, Video2: {len(segments2)}")
+        logger.info("Expected segments - Video1: %s, Video2: %s", expected_segments1, expected_segments2)
+        logger.info("Actual segments - Video1: %s, Video2: %s", num_segments1, num_segments2)
         
         # Additional validation for segment count vs duration
-        if len(segments1) < expected_segments1 * 0.8:  # Allow 20% tolerance
-            logger.error(f"Video1 has insufficient segments. Expected at least {expected_segments1 * 0.8}, got {len(segments1)}")
-            raise HTTPException(status_code=400, detail=f"Video1 has insufficient segments - embedding generation incomplete. Expected ~{expected_segments1}, got {len(segments1)}")
+        if num_segments1 < expected_segments1 * 0.8:  # Allow 20% tolerance
+            logger.error("Video1 has insufficient segments. Expected at least %s, got %s", expected_segments1 * 0.8, num_segments1)
+            raise HTTPException(status_code=400, detail=f"Video1 has insufficient segments - embedding generation incomplete. Expected ~{expected_segments1}, got {num_segments1}")
         
-        if len(segments2) < expected_segments2 * 0.8:  # Allow 20% tolerance
-            logger.error(f"Video2 has insufficient segments. Expected at least {expected_segments2 * 0.8}, got {len(segments2)}")
-            raise HTTPException(status_code=400, detail=f"Video2 has insufficient segments - embedding generation incomplete. Expected ~{expected_segments2}, got {len(segments2)}")
+        if num_segments2 < expected_segments2 * 0.8:  # Allow 20% tolerance
+            logger.error("Video2 has insufficient segments. Expected at least %s, got %s", expected_segments2 * 0.8, num_segments2)
+            raise HTTPException(status_code=400, detail=f"Video2 has insufficient segments - embedding generation incomplete. Expected ~{expected_segments2}, got {num_segments2}")
         
         # Validate that segments cover the full duration
-        if segments1 and segments1[-1]['end_offset_sec'] < duration1 * 0.8:
-            logger.error(f"Video1 segments don't cover full duration. Last segment ends at {segments1[-1]['end_offset_sec']}s, video is {duration1}s")
+        if num_segments1 and ends1[-1] < duration1 * 0.8:
+            logger.error("Video1 segments don't cover full duration. Last segment ends at %ss, video is %ss", ends1[-1], duration1)
             raise HTTPException(status_code=400, detail=f"Video1 segments don't cover full duration - embedding generation incomplete")
         
-        if segments2 and segments2[-1]['end_offset_sec'] < duration2 * 0.8:
-            logger.error(f"Video2 segments don't cover full duration. Last segment ends at {segments2[-1]['end_offset_sec']}s, video is {duration2}s")
+        if num_segments2 and ends2[-1] < duration2 * 0.8:
+            logger.error("Video2 segments don't cover full duration. Last segment ends at %ss, video is %ss", ends2[-1], duration2)
             raise HTTPException(status_code=400, detail=f"Video2 segments don't cover full duration - embedding generation incomplete")
         
-        logger.info(f"Segment validation passed - both videos have sufficient segments covering full duration")
+        logger.info("Segment validation passed - both videos have sufficient segments covering full duration")
         
         # Compare segments using actual embedding data
         differing_segments = []
-        all_distances = []
+        distances = np.empty(0, dtype=np.float32)
         matched_segments = 0
+        actual_differing = 0
+        extra_segments = 0
         
         # Handle case where one or both videos have no segments
-        if len(segments1) == 0 or len(segments2) == 0:
-            logger.error(f"Cannot compare videos - missing segments! Video1: {len(segments1)}, Video2: {len(segments2)}")
+        if num_segments1 == 0 or num_segments2 == 0:
+            logger.error("Cannot compare videos - missing segments! Video1: %s, Video2: %s", num_segments1, num_segments2)
             
             # Mark entire duration as different
-            differing_segments.append(DifferenceSegment(
-                start_sec=0,
-                end_sec=max_duration,
-                distance=999999.0  # Use large number instead of infinity
-            ))
+            differing_segments.append({
+                "start_sec": 0,
+                "end_sec": max_duration,
+                "distance": 999999.0  # Use large number instead of infinity
+            })
             
             # Return early with error response
-            return ComparisonResponse(
-                filename1=embed_data1["filename"],
-                filename2=embed_data2["filename"],
-                differences=differing_segments,
-                total_segments=0,
-                differing_segments=1,
-                threshold_used=threshold
-            )
+            return ORJSONResponse({
+                "filename1": embed_data1["filename"],
+                "filename2": embed_data2["filename"],
+                "differences": differing_segments,
+                "total_segments": 0,
+                "differing_segments": 1,
+                "threshold_used": threshold
+            })
         
         # Compare segments at regular intervals based on the shorter video's segments
-        min_segments = min(len(segments1), len(segments2))
-        logger.info(f"Will compare {min_segments} segments (minimum of both videos)")
+        min_segments = min(num_segments1, num_segments2)
+        logger.info("Will compare %s segments (minimum of both videos)", min_segments)
         
         if min_segments == 0:
             # This shouldn't happen now due to the check above, but just in case
             logger.error("min_segments is 0 despite having segments - this is a bug!")
-            differing_segments.append(DifferenceSegment(
-                start_sec=0,
-                end_sec=max_duration,
-                distance=999999.0
-            ))
-        else:
-            # Compare corresponding segments - this should give us exactly min_segments results
-            for i in range(min_segments):
-                seg1 = segments1[i]
-                seg2 = segments2[i]
-                
-                logger.info(f"Comparing segment {i}: Video1 {seg1['start_offset_sec']}-{seg1['end_offset_sec']}s vs Video2 {seg2['start_offset_sec']}-{seg2['end_offset_sec']}s")
-                
-                # Calculate distance between embeddings
-                v1 = np.array(seg1["embedding"], dtype=np.float32)
-                v2 = np.array(seg2["embedding"], dtype=np.float32)
-                
-                if distance_metric == "cosine":
-                    # Cosine distance
-                    dot = np.dot(v1, v2)
-                    norm1 = np.linalg.norm(v1)
-                    norm2 = np.linalg.norm(v2)
-                    dist = 1.0 - (dot / (norm1 * norm2)) if norm1 > 0 and norm2 > 0 else 1.0
-                else:
-                    # Euclidean distance
-                    dist = float(np.linalg.norm(v1 - v2))
-                
-                all_distances.append(float(dist))
-                matched_segments += 1
-                
-                logger.info(f"Segment {i} distance: {dist:.4f} (threshold: {threshold})")
-                
-                # Only add segments that exceed the threshold
-                if float(dist) > threshold:
-                    differing_segments.append(DifferenceSegment(
-                        start_sec=seg1["start_offset_sec"],
-                        end_sec=seg1["end_offset_sec"],
-                        distance=float(dist)
-                    ))
-            
-            # Only add remaining segments if they don't overlap with existing ones
-            if len(segments1) > len(segments2):
-                # Video1 has more segments - only add if they don't overlap
-                for i in range(len(segments2), len(segments1)):
-                    seg = segments1[i]
-                    # Check if this segment overlaps with any existing segment
-                    overlaps = False
-                    for existing in differing_segments:
-                        if (seg["start_offset_sec"] < existing.end_sec and 
-                            seg["end_offset_sec"] > existing.start_sec):
-                            overlaps = True
-                            break
-                    
-                    if not overlaps:
-                        differing_segments.append(DifferenceSegment(
-                            start_sec=seg["start_offset_sec"],
-                            end_sec=seg["end_offset_sec"],
-                            distance=999999.0  # Use large number instead of infinity
-                        ))
-            elif len(segments2) > len(segments1):
-                # Video2 has more segments - only add if they don't overlap
-                for i in range(len(segments1), len(segments2)):
-                    seg = segments2[i]
-                    # Check if this segment overlaps with any existing segment
-                    overlaps = False
-                    for existing in differing_segments:
-                        if (seg["start_offset_sec"] < existing.end_sec and 
-                            seg["end_offset_sec"] > existing.start_sec):
-                            overlaps = True
-                            break
-                    
-                    if not overlaps:
-                        differing_segments.append(DifferenceSegment(
-                            start_sec=seg["start_offset_sec"],
-                            end_sec=seg["end_offset_sec"],
-                            distance=999999.0  # Use large number instead of infinity
-                        ))
-        
-        # Calculate similarity percentage based on segments that are NOT different
-        if min_segments > 0:
-            # Only count segments that were actually compared (not the 999999.0 ones)
-            actual_differing = len([d for d in differing_segments if d.distance < 999999.0])
-            similar_segments = min_segments - actual_differing
-            similarity_percent = max(0, (similar_segments / min_segments) * 100)
+            differing_segments.append({
+                "start_sec": 0,
+                "end_sec": max_duration,
+                "distance": 999999.0
+            })
         else:
-            similarity_percent = 0
-        
-        if all_distances:
-            logger.info(f"Distance stats - Min: {min(all_distances):.4f}, Max: {max(all_distances):.4f}, Mean: {np.mean(all_distances):.4f}")
-            logger.info(f"Similarity: {similarity_percent:.2f}%")
-        
-        # Count actual differing segments (excluding 999999.0 ones)
-        actual_differing = len([d for d in differing_segments if d.distance < 999999.0])
-        extra_segments = len([d for d in differing_segments if d.distance >= 999999.0])
-        
-        logger.info(f"Found {len(differing_segments)} total segments in response")
-        logger.info(f"  - {actual_differing} actual differing segments (distance > {threshold})")
-        logger.info(f"  - {extra_segments} extra segments from different video lengths")
-        logger.info(f"Matched segments: {matched_segments}, Total segments: {min_segments}")
-        logger.info(f"Similarity calculation: {min_segments - actual_differing}/{min_segments} = {similarity_percent:.2f}%")
-        
-        return ComparisonResponse(
-            filename1=embed_data1["filename"],
-            filename2=embed_data2["filename"],
-            differences=differing_segments,
-            total_segments=min_segments,
-            differing_segments=len(differing_segments),
-            threshold_used=threshold
-        )
+            # Distance math and response assembly are CPU-bound, so keep them off the event loop
+            differing_segments, distances, actual_differing, extra_segments = await asyncio.to_thread(
+                compute_segment_differences, embed_data1, embed_data2, threshold, distance_metric, merge_adjacent
+            )
+            matched_segments = len(distances)
+        
+        # Calculate similarity percentage based on compared segments that are NOT different
+        similarity_percent = max(0.0, 100.0 * (min_segments - actual_differing) / min_segments) if min_segments else 0.0
+        
+        if distances.size and logger.isEnabledFor(logging.INFO):
+            logger.info("Distance stats - Min: %.4f, Max: %.4f, Mean: %.4f", distances.min(), distances.max(), distances.mean())
+            logger.info("Similarity: %.2f%%", similarity_percent)
+        
+        logger.info("Found %s total segments in response", len(differing_segments))
+        logger.info("  - %s actual differing segments (distance > %s)", actual_differing, threshold)
+        logger.info("  - %s extra segments from different video lengths", extra_segments)
+        logger.info("Matched segments: %s, Total segments: %s", matched_segments, min_segments)
+        logger.info("Similarity calculation: %s/%s = %.2f%%", min_segments - actual_differing, min_segments, similarity_percent)
+        
+        # Return the payload directly so the response skips Pydantic validation
+        return ORJSONResponse({
+            "filename1": embed_data1["filename"],
+            "filename2": embed_data2["filename"],
+            "differences": differing_segments,
+            "total_segments": min_segments,
+            "differing_segments": len(differing_segments),
+            "threshold_used": threshold
+        })
         
     except Exception as e:
-        logger.error(f"Error comparing videos: {e}")
-        logger.error(f"Exception type: {type(e).__name__}")
+        logger.error("Error comparing videos: %s", e)
+        logger.error("Exception type: %s", type(e).__name__)
         import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error("Traceback: %s", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to compare videos: {str(e)}")
 
+@app.get("/find-similar-segments", response_model=SimilarSegmentsResponse, response_class=ORJSONResponse)
+async def find_similar_segments(
+    embedding_id1: str = Query(...),
+    embedding_id2: str = Query(...),
+    k: int = Query(5, ge=1)
+):
+    """Find the k most similar segments in video 2 for every segment in video 1."""
+    embed_data1 = await get_embedding_data(embedding_id1)
+    embed_data2 = await get_embedding_data(embedding_id2)
+    
+    if embed_data1 is None or embed_data2 is None:
+        raise HTTPException(status_code=404, detail="Embeddings not found")
+    
+    for embedding_id, embed_data in ((embedding_id1, embed_data1), (embedding_id2, embed_data2)):
+        if embed_data["status"] != "completed":
+            raise HTTPException(status_code=400, detail=f"Embedding {embedding_id} is not ready. Status: {embed_data['status']}")
+    
+    k = min(k, len(embed_data2["starts"]))
+    segments = await asyncio.to_thread(search_similar_segments, embedding_id1, embed_data1,
+                                       embedding_id2, embed_data2, k)
+    
+    return ORJSONResponse({
+        "filename1": embed_data1["filename"],
+        "filename2": embed_data2["filename"],
+        "segments": segments
+    })
+
 @app.get("/serve-video/{video_id}")
 async def serve_video(video_id: str):
     """Get video URL for streaming."""
@@ -1004,17 +1647,17 @@ async def serve_video(video_id: str):
     s3_url = video_data["s3_url"]
     
     # Generate a presigned URL for direct access
-    presigned_url = get_s3_presigned_url(s3_url)
+    presigned_url = await asyncio.to_thread(get_s3_presigned_url, s3_url)
     
     return {"video_url": presigned_url}
 
 @app.get("/embedding-status/{embedding_id}")
 async def get_embedding_status(embedding_id: str):
     """Get the status of embedding generation for a video."""
-    if embedding_id not in embedding_storage:
+    embedding_data = await get_embedding_data(embedding_id)
+    if embedding_data is None:
         raise HTTPException(status_code=404, detail="Embedding not found")
     
-    embedding_data = embedding_storage[embedding_id]
     return {
         "embedding_id": embedding_id,
         "filename": embedding_data["filename"],
@@ -1037,8 +1680,8 @@ async def get_video_status(video_id: str):
     video_data = video_storage[video_id]
     embedding_id = video_data.get("embedding_id")
     
-    if embedding_id and embedding_id in embedding_storage:
-        embed_data = embedding_storage[embedding_id]
+    embed_data = lookup_embedding(embedding_id) if embedding_id else None
+    if embed_data is not None:
         return {
             "video_id": video_id,
             "filename": video_data["filename"],
@@ -1070,8 +1713,8 @@ async def cancel_video_processing(video_id: str):
         embedding_id = video_data.get("embedding_id")
         
         # Cancel embedding task if it exists and is still processing
-        if embedding_id and embedding_id in embedding_storage:
-            embed_data = embedding_storage[embedding_id]
+        embed_data = lookup_embedding(embedding_id) if embedding_id else None
+        if embed_data is not None:
             if embed_data["status"] in ["processing", "pending"]:
                 logger.info(f"Cancelling embedding task for {embedding_id}")
                 try:
@@ -1090,8 +1733,12 @@ async def cancel_video_processing(video_id: str):
         
         # Remove from storage
         del video_storage[video_id]
-        if embedding_id and embedding_id in embedding_storage:
-            del embedding_storage[embedding_id]
+        if embed_data is not None:
+            embedding_jobs.pop(embedding_id, None)
+            embedding_storage.pop(embedding_id, None)
+            with dequantized_lock:
+                dequantized_storage.pop(embedding_id, None)
+            remove_embedding_mmap(embed_data)
         
         logger.info(f"Successfully cancelled and cleaned up {video_id}")
         return {"message": "Video processing cancelled successfully"}
@@ -1106,11 +1753,10 @@ async def cancel_embedding_task(embedding_id: str):
     try:
         logger.info(f"Cancelling embedding task for {embedding_id}")
         
-        if embedding_id not in embedding_storage:
+        embed_data = lookup_embedding(embedding_id)
+        if embed_data is None:
             raise HTTPException(status_code=404, detail="Embedding not found")
         
-        embed_data = embedding_storage[embedding_id]
-        
         if embed_data["status"] not in ["processing", "pending"]:
             raise HTTPException(status_code=400, detail="Embedding is not in a cancellable state")
         
@@ -1138,8 +1784,7 @@ async def cancel_embedding_task(embedding_id: str):
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Server health check with detailed status information."""
-    uptime = datetime.now() - start_time
-    uptime_seconds = uptime.total_seconds()
+    uptime_seconds = asyncio.get_running_loop().time() - start_monotonic
     
     # Format uptime
     hours = int(uptime_seconds // 3600)
@@ -1149,10 +1794,9 @@ async def health_check():
     
     # Check database status (only for API keys)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("SELECT 1")
+        with db_connection() as conn:
+            conn.execute("SELECT 1")
         db_status = "healthy"
-        conn.close()
     except Exception:
         db_status = "unhealthy"
     
@@ -1176,10 +1820,20 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
+    
+    # Video, embedding and task state lives in process memory, so extra
+    # workers only make sense once that state moves to a shared store
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1:
+        logger.warning(f"Running {workers} workers: in-memory video and embedding state is not shared between them")
+    
+    # Multiple workers need an import string; a single worker runs this module's app
+    # directly so module-level setup isn't repeated by a second import
     uvicorn.run(
-        app, 
+        "app:app" if workers > 1 else app, 
         host="0.0.0.0", 
         port=8000,
+        workers=workers,
         timeout_keep_alive=300,  # 5 minutes keep-alive
         timeout_graceful_shutdown=300,  # 5 minutes graceful shutdown
         limit_concurrency=10,  # Limit concurrent connections
@@ -23,6 +23,12 @@ export interface VideoUploadResponse {
   status: string;
 }
 
+export interface UploadUrlResponse {
+  url: string;
+  fields: Record<string, string>;
+  s3_url: string;
+}
+
 export interface Difference {
   start_sec: number;
   end_sec: number;
@@ -105,6 +111,18 @@ class ApiClient {
   }
 
   async uploadVideo(file: File): Promise<VideoUploadResponse> {
+    // Only fall back when the file never reached S3; a failed registration is a real error
+    let s3Url: string | null = null;
+    try {
+      s3Url = await this.uploadToS3(file);
+    } catch (error) {
+      console.warn('Direct S3 upload failed, falling back to backend upload:', error);
+    }
+
+    if (s3Url) {
+      return this.registerUpload(s3Url, file.name);
+    }
+
     const formData = new FormData();
     formData.append('file', file);
 
@@ -120,6 +138,35 @@ class ApiClient {
     return response.json();
   }
 
+  private async uploadToS3(file: File): Promise<string> {
+    const { url, fields, s3_url } = await this.request<UploadUrlResponse>('/create-upload-url', {
+      method: 'POST',
+      body: JSON.stringify({ filename: file.name, content_type: file.type }),
+    });
+
+    const formData = new FormData();
+    Object.entries(fields).forEach(([key, value]) => formData.append(key, value));
+    formData.append('file', file);
+
+    const uploadResponse = await fetch(url, {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!uploadResponse.ok) {
+      throw new Error(`Direct upload failed: ${uploadResponse.statusText}`);
+    }
+
+    return s3_url;
+  }
+
+  private async registerUpload(s3Url: string, filename: string): Promise<VideoUploadResponse> {
+    return this.request<VideoUploadResponse>('/register-upload', {
+      method: 'POST',
+      body: JSON.stringify({ s3_url: s3Url, filename }),
+    });
+  }
+
   async cancelEmbeddingTask(embeddingId: string): Promise<CancelTaskResponse> {
     return this.request<CancelTaskResponse>(`/cancel-embedding-task/${embeddingId}`, {
       method: 'POST',